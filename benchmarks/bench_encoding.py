@@ -0,0 +1,157 @@
+"""
+Compares what it costs to turn the records behind the largest responses into
+a response body, three ways:
+
+* `generic`: dicts built from the records, then `jsonable_encoder` and
+  `JSONResponse`, which is what the routes did before they had response
+  models.
+* `validated`: models built from the records and passed through FastAPI's
+  `serialize_response`, which is what happens when a route returns models
+  instead of a Response.
+* `fast`: models built with `construct` and rendered by `ModelResponse`,
+  which is what the routes do now.
+
+Each mode starts from the same `src/datatypes.py` records, so the time includes
+building the dicts or models as well as encoding them. The scans that find the
+records are left out, since every mode shares them.
+
+Run from the repository root so the CSV files can be found:
+
+    python -m benchmarks.bench_encoding
+"""
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from typing import List
+import asyncio
+import timeit
+
+from src import database as db
+from src.api import lines
+from src.api.models import CharacterListItem, ConversationItem, LineItem, ModelResponse
+
+
+def character_dicts(characters):
+    return (
+        {
+            "character_id" : c.id,
+            "character" : c.name,
+            "movie" : db.movies[c.movie_id].title,
+            "number_of_lines" : c.num_lines,
+        }
+        for c in characters
+    )
+
+
+def character_models(characters):
+    return [
+        CharacterListItem.from_record(c, db.movies[c.movie_id])
+        for c in characters
+    ]
+
+
+def line_dicts(movie_lines):
+    return (
+        {
+            "character" : (lambda c: c and c.name)(db.characters.get(line.c_id)),
+            "line" : line.line_text
+        }
+        for line in movie_lines
+    )
+
+
+def line_models(movie_lines):
+    return [
+        LineItem.from_record(line, db.characters.get(line.c_id))
+        for line in movie_lines
+    ]
+
+
+def conversation_dicts(convs):
+    charname = lambda c: c and c.name  # noqa: E731
+    return (
+        {
+            "conversation_id" : id,
+            "lines" : (
+                {
+                    "character" : charname(db.characters.get(line.c_id)),
+                    "line" : line.line_text
+                }
+                for line in line_list
+            )
+        }
+        for id, line_list in convs
+    )
+
+
+def conversation_models(convs):
+    return [
+        ConversationItem.from_record(id, line_list, db.characters)
+        for id, line_list in convs
+    ]
+
+
+def largest_payloads():
+    # The movie with the most lines gives the biggest /lines and /conversations pages
+    movie_id = max(
+        db.movies,
+        key=lambda id: sum(
+            c.num_lines for c in db.characters.values() if c.movie_id == id
+        ),
+    )
+
+    return {
+        "/characters/?limit=250": (
+            List[CharacterListItem],
+            list(db.characters.values())[:250],
+            character_dicts,
+            character_models,
+        ),
+        f"/lines/{movie_id}/?limit=500": (
+            List[LineItem],
+            lines.find_lines(movie_id, "")[:500],
+            line_dicts,
+            line_models,
+        ),
+        f"/conversations/{movie_id}/?limit=500": (
+            List[ConversationItem],
+            lines.find_conversations(movie_id, "")[:500],
+            conversation_dicts,
+            conversation_models,
+        ),
+    }
+
+
+def main(number=200):
+    loop = asyncio.new_event_loop()
+
+    for name, payload in largest_payloads().items():
+        response_model, records, to_dicts, to_models = payload
+        field = create_response_field(name="response", type_=response_model)
+
+        def generic():
+            return JSONResponse(jsonable_encoder(to_dicts(records))).body
+
+        def validated():
+            content = loop.run_until_complete(serialize_response(
+                field=field, response_content=to_models(records), is_coroutine=True
+            ))
+            return JSONResponse(content).body
+
+        def fast():
+            return ModelResponse(to_models(records)).body
+
+        body = fast()
+        assert generic() == body
+
+        print(f"{name} ({len(body)} bytes)")
+        for fn in (generic, validated, fast):
+            per_request = timeit.timeit(fn, number=number) / number
+            print(f"    {fn.__name__:>9}: {per_request * 1000:.3f} ms")
+
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
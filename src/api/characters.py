@@ -1,9 +1,12 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
 from enum import Enum
 from collections import Counter
 
 from fastapi.params import Query
 from src import database as db
+from src.api.singleflight import flight
+from src.api.models import CharacterDetail, CharacterListItem, ModelResponse
+from typing import List
 import json
 
 router = APIRouter()
@@ -22,9 +25,23 @@ def get_top_conv_characters(character):
         line_counts[other_id] += conv.num_lines
 
     return line_counts.most_common()
-    
-@router.get("/characters/{id}", tags=["characters"])
-def get_character(id: int):
+
+
+# Runs the scan as an async dependency, so identical requests are coalesced on
+# the event loop before the route takes a worker thread.
+async def scan_top_conv_characters(id: int):
+    character = db.characters.get(id)
+    if character:
+        return await flight.do(("characters", id), get_top_conv_characters, character)
+
+
+@router.get(
+    "/characters/{id}",
+    tags=["characters"],
+    response_model=CharacterDetail,
+    response_class=ModelResponse,
+)
+def get_character(id: int, top_convs: list = Depends(scan_top_conv_characters)):
     """
     This endpoint returns a single character by its identifier. For each character
     it returns:
@@ -53,22 +70,12 @@ def get_character(id: int):
     if character:
         # print("character found")
         movie = db.movies.get(character.movie_id)
-        result = {
-            "character_id" : character.id,
-            "character" : character.name,
-            "movie" : movie and movie.title,
-            "gender" : character.gender,
-            "top_conversations" : (
-                {
-                    "character_id" : other_id,
-                    "character" : db.characters[other_id].name,
-                    "gender" : db.characters[other_id].gender,
-                    "number_of_lines_together" : lines
-                }
-                for other_id, lines in get_top_conv_characters(character)
-            )
-        }
-        return result
+        result = CharacterDetail.from_record(
+            character,
+            movie,
+            [(db.characters[other_id], lines) for other_id, lines in top_convs],
+        )
+        return ModelResponse(result)
 
     raise HTTPException(status_code=404, detail="character not found.")
 
@@ -79,7 +86,12 @@ class character_sort_options(str, Enum):
     number_of_lines = "number_of_lines"
 
 
-@router.get("/characters/", tags=["characters"])
+@router.get(
+    "/characters/",
+    tags=["characters"],
+    response_model=List[CharacterListItem],
+    response_class=ModelResponse,
+)
 def list_characters(
     name: str = "",
     limit: int = Query(50, ge=1, le=250),
@@ -123,13 +135,8 @@ def list_characters(
     elif sort == character_sort_options.number_of_lines:
         items.sort(key=lambda c: none_last(c.num_lines, True), reverse=True)
 
-    json = (
-        {
-            "character_id" : c.id,
-            "character" : c.name,
-            "movie" : db.movies[c.movie_id].title,
-            "number_of_lines" : c.num_lines,
-        }
+    json = [
+        CharacterListItem.from_record(c, db.movies[c.movie_id])
         for c in items[offset:offset+limit]
-    )
-    return json
+    ]
+    return ModelResponse(json)
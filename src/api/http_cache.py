@@ -0,0 +1,204 @@
+import gzip
+import re
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, we fall back to gzip without it
+    brotli = None
+
+# Sits in front of the routers and takes care of the HTTP side of caching:
+# Cache-Control/Vary headers per route, gzip/brotli compression and serving
+# payloads that were already compressed when the data was loaded.
+
+
+def parse_accept_encoding(header):
+    """
+    Returns a dict of coding -> q value for an Accept-Encoding header. Codings
+    with q=0 are kept, since they mean the client refuses them.
+    """
+    qvalues = {}
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qvalues[coding] = q
+    return qvalues
+
+
+def choose_encoding(header):
+    """
+    Picks the best encoding we support for an Accept-Encoding header, or None
+    for identity. A coding listed by name uses its own q value, otherwise the
+    q value of `*`. The highest q wins, and brotli wins ties.
+    """
+    qvalues = parse_accept_encoding(header)
+    supported = ["br", "gzip"] if brotli else ["gzip"]
+
+    best, best_q = None, 0.0
+    for coding in supported:
+        q = qvalues.get(coding, qvalues.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def compress(body, encoding, compresslevel=6):
+    if encoding == "br":
+        return brotli.compress(body, quality=min(compresslevel, 11))
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=compresslevel, mtime=0)
+    return body
+
+
+class PrecompressedPayload:
+    """
+    A response body that is stored in every encoding we can serve, so the
+    middleware only has to pick one.
+    """
+
+    def __init__(self, body, media_type="application/json", compresslevel=9):
+        self.media_type = media_type
+        self.bodies = {None: body, "gzip": compress(body, "gzip", compresslevel)}
+        if brotli:
+            self.bodies["br"] = compress(body, "br", 11)
+
+
+class HTTPCacheMiddleware:
+    """
+    ASGI middleware that adds Cache-Control/Vary headers and compresses
+    responses.
+
+    * `cache_rules`: list of `(path regex, Cache-Control value)`. The first
+      pattern that fully matches the path is used, and only 200 responses get
+      the header.
+    * `minimum_size`: bodies smaller than this many bytes are sent as-is.
+    * `precompressed`: dict of path -> `PrecompressedPayload`, served directly
+      for GET requests to that path without a query string.
+    """
+
+    def __init__(
+        self,
+        app,
+        cache_rules=(),
+        minimum_size=500,
+        compresslevel=6,
+        precompressed=None,
+    ):
+        self.app = app
+        self.cache_rules = [
+            (re.compile(pattern), value) for pattern, value in cache_rules
+        ]
+        self.minimum_size = minimum_size
+        self.compresslevel = compresslevel
+        self.precompressed = precompressed if precompressed is not None else {}
+
+    def cache_control(self, path):
+        for pattern, value in self.cache_rules:
+            if pattern.fullmatch(path):
+                return value
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        encoding = choose_encoding(
+            headers.get(b"accept-encoding", b"").decode("latin-1")
+        )
+        path = scope["path"]
+        cache_control = self.cache_control(path)
+
+        payload = self.precompressed.get(path)
+        if payload and scope["method"] == "GET" and not scope["query_string"]:
+            await self.send_precompressed(send, payload, encoding, cache_control)
+            return
+
+        # starlette already strips the body of HEAD responses, so they get the
+        # same headers as GET but nothing is compressed
+        head = scope["method"] == "HEAD"
+        start = None
+        body = []
+
+        async def send_wrapper(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+
+            await self.send_response(
+                start, b"".join(body), send, None if head else encoding,
+                cache_control, head,
+            )
+
+        await self.app(scope, receive, send_wrapper)
+
+    async def send_precompressed(self, send, payload, encoding, cache_control):
+        if encoding not in payload.bodies:
+            encoding = None
+        body = payload.bodies[encoding]
+        headers = [
+            (b"content-type", payload.media_type.encode("latin-1")),
+            (b"content-length", str(len(body)).encode("latin-1")),
+            (b"vary", b"Accept-Encoding"),
+        ]
+        if encoding:
+            headers.append((b"content-encoding", encoding.encode("latin-1")))
+        if cache_control:
+            headers.append((b"cache-control", cache_control.encode("latin-1")))
+
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+    async def send_response(
+        self, start, body, send, encoding, cache_control, head=False
+    ):
+        existing = {key.lower(): value for key, value in start["headers"]}
+        # HEAD keeps the length of the body it would have had
+        dropped = (b"vary",) if head else (b"content-length", b"vary")
+        headers = [
+            (key, value) for key, value in start["headers"]
+            if key.lower() not in dropped
+        ]
+
+        vary = [v.strip() for v in existing.get(b"vary", b"").split(b",") if v.strip()]
+        if b"accept-encoding" not in [v.lower() for v in vary]:
+            vary.append(b"Accept-Encoding")
+        headers.append((b"vary", b", ".join(vary)))
+
+        if (
+            encoding
+            and len(body) >= self.minimum_size
+            and b"content-encoding" not in existing
+        ):
+            body = compress(body, encoding, self.compresslevel)
+            headers.append((b"content-encoding", encoding.encode("latin-1")))
+
+        if (
+            cache_control
+            and start["status"] == 200
+            and b"cache-control" not in existing
+        ):
+            headers.append((b"cache-control", cache_control.encode("latin-1")))
+
+        if not head:
+            headers.append((b"content-length", str(len(body)).encode("latin-1")))
+        await send({**start, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
@@ -1,18 +1,91 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
 from enum import Enum
 from src import database as db
 from src.datatypes import Character, Movie, Conversation, Line
 from fastapi.params import Query
+from src.api.singleflight import flight
+from src.api.models import (
+    ConversationDetail, ConversationItem, LineItem, ModelResponse
+)
+from typing import List
 
 router = APIRouter()
 
 
-@router.get("/lines/{movie_id}/", tags=["lines"])
+def line_filter(movie_id, character):
+    if character:
+        return lambda line: line.movie_id == movie_id \
+                    and db.characters.get(line.c_id).name == character
+    return lambda line: line.movie_id == movie_id
+
+
+def find_lines(movie_id, character):
+    lines = [l for l in filter(line_filter(movie_id, character), db.lines.values())]
+    lines.sort(key=lambda l: (l.conv_id, l.line_sort))
+    return lines
+
+
+def find_conversations(movie_id, character):
+    conv_lines = {}
+
+    for line in filter(line_filter(movie_id, character), db.lines.values()):
+        if line.conv_id not in conv_lines:
+            conv_lines[line.conv_id] = []
+        conv_lines[line.conv_id].append(line)
+
+    for line_list in conv_lines.values():
+        line_list.sort(key=lambda l: l.line_sort)
+
+    convs = list(conv_lines.items())
+    convs.sort() # sorts by first part of tuple, which is the id
+    return convs
+
+
+def find_conversation_lines(conversation_id):
+    lines = [line for line in db.lines.values() if line.conv_id == conversation_id]
+    lines.sort(key=lambda line: line.line_sort)
+    return lines
+
+
+# The scans run in these async dependencies, so identical requests are
+# coalesced on the event loop before the route takes a worker thread.
+
+async def scan_lines(movie_id: int, character: str = ""):
+    if movie_id in db.movies:
+        character = character.upper()
+        return await flight.do(
+            ("lines", movie_id, character), find_lines, movie_id, character
+        )
+
+
+async def scan_conversations(movie_id: int, character: str = ""):
+    if movie_id in db.movies:
+        character = character.upper()
+        return await flight.do(
+            ("conversations", movie_id, character),
+            find_conversations, movie_id, character
+        )
+
+
+async def scan_conversation_lines(conversation_id: int):
+    if conversation_id in db.conversations:
+        return await flight.do(
+            ("conversation", conversation_id), find_conversation_lines, conversation_id
+        )
+
+
+@router.get(
+    "/lines/{movie_id}/",
+    tags=["lines"],
+    response_model=List[LineItem],
+    response_class=ModelResponse,
+)
 def get_lines(
     movie_id: int,
     character: str = "",
     limit: int = Query(50, ge=1, le=500),
     offset: int = Query(0, ge=0),
+    lines: list = Depends(scan_lines),
 ):
     """
     This endpoint returns all the lines in a movie as a list. Each entry contains:
@@ -25,33 +98,27 @@ def get_lines(
 
     movie = db.movies.get(movie_id)
     if movie:
-
-        filter_fn = lambda line: line.movie_id == movie_id
-        if character:
-            filter_fn = lambda line: line.movie_id == movie_id \
-                        and db.characters.get(line.c_id).name == character.upper()
-
-        lines = [l for l in filter(filter_fn, db.lines.values())]
-        lines.sort(key=lambda l: (l.conv_id, l.line_sort))
-
-        result = (
-            {
-                "character" : (lambda c: c and c.name)(db.characters.get(l.c_id)),
-                "line" : l.line_text
-            }
+        result = [
+            LineItem.from_record(l, db.characters.get(l.c_id))
             for l in lines[offset : offset + limit]
-        )
-        return result
+        ]
+        return ModelResponse(result)
 
     raise HTTPException(status_code=404, detail="movie not found.")
 
 
-@router.get("/conversations/{movie_id}/", tags=["lines"])
+@router.get(
+    "/conversations/{movie_id}/",
+    tags=["lines"],
+    response_model=List[ConversationItem],
+    response_class=ModelResponse,
+)
 def get_conversations(
     movie_id: int,
     character: str = "",
     limit: int = Query(50, ge=1, le=500),
     offset: int = Query(0, ge=0),
+    convs: list = Depends(scan_conversations),
 ):
     """
     This endpoint returns all the conversations in a movie. Each conversation contains:
@@ -67,48 +134,25 @@ def get_conversations(
 
     movie = db.movies.get(movie_id)
     if movie:
-
-        filter_fn = lambda line: line.movie_id == movie_id
-        if character:
-            filter_fn = lambda line: line.movie_id == movie_id \
-                        and db.characters.get(line.c_id).name == character.upper()
-
-
-        conv_lines = {}
-
-        for line in filter(filter_fn, db.lines.values()):
-            if line.conv_id not in conv_lines:
-                conv_lines[line.conv_id] = []
-            conv_lines[line.conv_id].append(line)
-        
-        for line_list in conv_lines.values():
-            line_list.sort(key=lambda l: l.line_sort)
-
-        convs = list(conv_lines.items())
-        convs.sort() # sorts by first part of tuple, which is the id
-        
-        charname = lambda c: c and c.name
-
-        result = (
-            {
-                "conversation_id" : id,
-                "lines" : (
-                    {
-                        "character" : charname(db.characters.get(line.c_id)),
-                        "line" : line.line_text
-                    }
-                    for line in line_list
-                )
-            }
+        result = [
+            ConversationItem.from_record(id, line_list, db.characters)
             for id, line_list in convs[offset : offset + limit]
-        )
-        return result
+        ]
+        return ModelResponse(result)
 
     raise HTTPException(status_code=404, detail="movie not found.")
 
 
-@router.get("/conversation/{conversation_id}", tags=["lines"])
-def get_conversation(conversation_id: int):
+@router.get(
+    "/conversation/{conversation_id}",
+    tags=["lines"],
+    response_model=ConversationDetail,
+    response_class=ModelResponse,
+)
+def get_conversation(
+    conversation_id: int,
+    lines: list = Depends(scan_conversation_lines),
+):
     """
     This endpoint gets details about a conversation:
     * `movie_id`: the internal id of the movie.
@@ -127,28 +171,9 @@ def get_conversation(conversation_id: int):
     
     conv = db.conversations.get(conversation_id)
     if conv:
-        charname = lambda c: c and c.name
-        lines = list(filter(lambda l: l.conv_id == conversation_id, db.lines.values()))
-        lines.sort(key=lambda l: l.line_sort)
-        result = {
-            "movie_id" : conv.movie_id,
-            "title" : (lambda m: m and m.title)(db.movies.get(conv.movie_id)),
-            "characters" : (
-                {
-                    "character_id" : id,
-                    "name" : charname(db.characters.get(id))
-                }
-                for id in [conv.c1_id, conv.c2_id]
-            ),
-            "num_lines" : conv.num_lines,
-            "lines" : (
-                {
-                    "character" : charname(db.characters.get(l.c_id)),
-                    "line" : l.line_text
-                }
-                for l in lines
-            )
-        }
-        return result
+        result = ConversationDetail.from_record(
+            conv, db.movies.get(conv.movie_id), lines, db.characters
+        )
+        return ModelResponse(result)
 
     raise HTTPException(status_code=404, detail="movie not found.")
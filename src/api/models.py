@@ -0,0 +1,195 @@
+from typing import List, Optional
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+import json
+
+# Response models for every endpoint. They give FastAPI a schema for the docs,
+# but the routes return them wrapped in a ModelResponse so FastAPI doesn't
+# validate and re-encode them. The values come straight from the records in
+# src/datatypes.py, which are already the right types, so the models are built
+# with `construct` and validation is skipped there too.
+
+
+class TopCharacter(BaseModel):
+    character_id: int
+    character: Optional[str]
+    num_lines: int
+
+    @classmethod
+    def from_record(cls, character):
+        return cls.construct(
+            character_id=character.id,
+            character=character.name,
+            num_lines=character.num_lines,
+        )
+
+
+class MovieDetail(BaseModel):
+    movie_id: int
+    title: Optional[str]
+    top_characters: List[TopCharacter]
+
+    @classmethod
+    def from_record(cls, movie, top_characters):
+        return cls.construct(
+            movie_id=movie.id,
+            title=movie.title,
+            top_characters=[TopCharacter.from_record(c) for c in top_characters],
+        )
+
+
+class MovieListItem(BaseModel):
+    movie_id: int
+    movie_title: Optional[str]
+    year: Optional[str]
+    imdb_rating: Optional[float]
+    imdb_votes: Optional[int]
+
+    @classmethod
+    def from_record(cls, movie):
+        return cls.construct(
+            movie_id=movie.id,
+            movie_title=movie.title,
+            year=movie.year,
+            imdb_rating=movie.imdb_rating,
+            imdb_votes=movie.imdb_votes,
+        )
+
+
+class TopConversation(BaseModel):
+    character_id: int
+    character: Optional[str]
+    gender: Optional[str]
+    number_of_lines_together: int
+
+    @classmethod
+    def from_record(cls, character, lines):
+        return cls.construct(
+            character_id=character.id,
+            character=character.name,
+            gender=character.gender,
+            number_of_lines_together=lines,
+        )
+
+
+class CharacterDetail(BaseModel):
+    character_id: int
+    character: Optional[str]
+    movie: Optional[str]
+    gender: Optional[str]
+    top_conversations: List[TopConversation]
+
+    @classmethod
+    def from_record(cls, character, movie, top_conversations):
+        return cls.construct(
+            character_id=character.id,
+            character=character.name,
+            movie=movie and movie.title,
+            gender=character.gender,
+            top_conversations=[
+                TopConversation.from_record(c, lines) for c, lines in top_conversations
+            ],
+        )
+
+
+class CharacterListItem(BaseModel):
+    character_id: int
+    character: Optional[str]
+    movie: Optional[str]
+    number_of_lines: int
+
+    @classmethod
+    def from_record(cls, character, movie):
+        return cls.construct(
+            character_id=character.id,
+            character=character.name,
+            movie=movie.title,
+            number_of_lines=character.num_lines,
+        )
+
+
+class LineItem(BaseModel):
+    character: Optional[str]
+    line: str
+
+    @classmethod
+    def from_record(cls, line, character):
+        return cls.construct(
+            character=character and character.name,
+            line=line.line_text,
+        )
+
+
+class ConversationItem(BaseModel):
+    conversation_id: int
+    lines: List[LineItem]
+
+    @classmethod
+    def from_record(cls, conversation_id, lines, characters):
+        return cls.construct(
+            conversation_id=conversation_id,
+            lines=[
+                LineItem.from_record(line, characters.get(line.c_id))
+                for line in lines
+            ],
+        )
+
+
+class ConversationCharacter(BaseModel):
+    character_id: int
+    name: Optional[str]
+
+    @classmethod
+    def from_record(cls, character_id, character):
+        return cls.construct(
+            character_id=character_id,
+            name=character and character.name,
+        )
+
+
+class ConversationDetail(BaseModel):
+    movie_id: int
+    title: Optional[str]
+    characters: List[ConversationCharacter]
+    num_lines: int
+    lines: List[LineItem]
+
+    @classmethod
+    def from_record(cls, conversation, movie, lines, characters):
+        return cls.construct(
+            movie_id=conversation.movie_id,
+            title=movie and movie.title,
+            characters=[
+                ConversationCharacter.from_record(id, characters.get(id))
+                for id in [conversation.c1_id, conversation.c2_id]
+            ],
+            num_lines=conversation.num_lines,
+            lines=[
+                LineItem.from_record(line, characters.get(line.c_id))
+                for line in lines
+            ],
+        )
+
+
+def model_dict(obj):
+    if isinstance(obj, BaseModel):
+        return obj.__dict__
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class ModelResponse(JSONResponse):
+    """
+    JSON response for the models above. Models are turned into their field
+    dicts by the C json encoder, skipping `jsonable_encoder`.
+    """
+
+    def render(self, content):
+        return json.dumps(
+            content,
+            default=model_dict,
+            ensure_ascii=False,
+            allow_nan=False,
+            indent=None,
+            separators=(",", ":"),
+        ).encode("utf-8")
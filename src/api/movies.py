@@ -3,12 +3,19 @@ from enum import Enum
 from src import database as db
 from src.datatypes import Character, Movie, Conversation, Line
 from fastapi.params import Query
+from src.api.models import MovieDetail, MovieListItem, ModelResponse
+from typing import List
 
 router = APIRouter()
 
 
 # include top 3 actors by number of lines
-@router.get("/movies/{movie_id}", tags=["movies"])
+@router.get(
+    "/movies/{movie_id}",
+    tags=["movies"],
+    response_model=MovieDetail,
+    response_class=ModelResponse,
+)
 def get_movie(movie_id: int):
     """
     This endpoint returns a single movie by its identifier. For each movie it returns:
@@ -29,22 +36,10 @@ def get_movie(movie_id: int):
     
     movie = db.movies.get(movie_id)
     if movie:
-        top_chars = [
-            {
-                "character_id" : c.id,
-                "character" : c.name,
-                "num_lines" : c.num_lines
-            }
-            for c in db.characters.values() if c.movie_id == movie_id
-        ]
-        top_chars.sort(key=lambda c: c["num_lines"], reverse=True)
-
-        result = {
-            "movie_id" : movie_id,
-            "title" : movie.title,
-            "top_characters" : top_chars[0:5]
-        }
-        return result
+        top_chars = [c for c in db.characters.values() if c.movie_id == movie_id]
+        top_chars.sort(key=lambda c: c.num_lines, reverse=True)
+
+        return ModelResponse(MovieDetail.from_record(movie, top_chars[0:5]))
 
     raise HTTPException(status_code=404, detail="movie not found.")
 
@@ -56,7 +51,12 @@ class movie_sort_options(str, Enum):
 
 
 # Add get parameters
-@router.get("/movies/", tags=["movies"])
+@router.get(
+    "/movies/",
+    tags=["movies"],
+    response_model=List[MovieListItem],
+    response_class=ModelResponse,
+)
 def list_movies(
     name: str = "",
     limit: int = Query(50, ge=1, le=250),
@@ -97,15 +97,6 @@ def list_movies(
     elif sort == movie_sort_options.rating:
         items.sort(key=lambda m: m.imdb_rating, reverse=True)
 
-    json = (
-        {
-            "movie_id" : m.id,
-            "movie_title" : m.title,
-            "year" : m.year,
-            "imdb_rating" : m.imdb_rating,
-            "imdb_votes" : m.imdb_votes
-        }
-        for m in items[offset:offset+limit]
-    )
-
-    return json
+    json = [MovieListItem.from_record(m) for m in items[offset:offset+limit]]
+
+    return ModelResponse(json)
@@ -2,6 +2,7 @@ from fastapi import APIRouter
 import os
 import pkg_resources
 import sys
+from src.api.singleflight import flight
 
 router = APIRouter()
 
@@ -44,3 +45,8 @@ def get_pkgsize():
 
     message = sorted(message, key=lambda d: d["size_in_mb"], reverse=True)
     return {"message": message}
+
+
+@router.get("/singleflight/")
+def get_singleflight_stats():
+    return flight.stats
@@ -0,0 +1,275 @@
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+import asyncio
+import contextvars
+import heapq
+import itertools
+import json
+import math
+import re
+import time
+
+# Keeps one client from using up the server. Every request takes tokens from
+# its client's bucket, with expensive routes costing more. Requests to the
+# expensive routes also wait in a weighted fair queue, so a client sending lots
+# of them only gets its share of the slots instead of all of them.
+#
+# The queue is entered through `queue_slot`, which the single-flight layer
+# wraps around the computation it actually runs. Requests that only wait on a
+# computation that is already running never take a slot, and waiting for a slot
+# happens on the event loop, so queued requests don't hold a worker thread.
+
+
+class TokenBucket:
+    def __init__(self, capacity, refill_rate, now):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.tokens = capacity
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.refill_rate
+        )
+        self.updated = now
+
+    def take(self, cost, now):
+        """
+        Takes `cost` tokens if there are enough. Returns whether they were
+        taken and, if not, how many seconds until there will be.
+        """
+        self.refill(now)
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return True, 0.0
+        return False, (cost - self.tokens) / self.refill_rate
+
+
+class FairQueue:
+    """
+    Limits how many requests run at once and, when they have to wait, lets
+    them in by weighted fair queueing: each request gets a virtual finish time
+    of `cost / weight` after its client's previous one, and the earliest
+    finish time goes next. A client with many queued requests keeps pushing
+    its own finish times back, so other clients' requests get in between.
+    """
+
+    def __init__(self, max_concurrent):
+        self.max_concurrent = max_concurrent
+        self.active = 0
+        self.virtual_time = 0.0
+        self._finish = {}
+        self._waiting = []
+        self._seq = itertools.count()
+
+    async def acquire(self, client, cost=1, weight=1.0):
+        start = max(self.virtual_time, self._finish.get(client, 0.0))
+        finish = start + cost / weight
+        self._finish[client] = finish
+
+        if self.active < self.max_concurrent and not self._waiting:
+            self.active += 1
+            self.virtual_time = start
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (finish, next(self._seq), start, waiter))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # The slot may have been handed to us just before we were cancelled
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        # Hand the slot straight to the next waiter so nobody can jump the queue
+        while self._waiting:
+            _, _, start, waiter = heapq.heappop(self._waiting)
+            if waiter.cancelled():
+                continue
+            self.virtual_time = start
+            waiter.set_result(None)
+            return
+
+        self.active -= 1
+        self._finish = {
+            client: finish for client, finish in self._finish.items()
+            if finish > self.virtual_time
+        }
+
+
+# Set by RateLimitMiddleware for requests to expensive routes to
+# `(queue, client, cost, weight)`, so `queue_slot` can find it further down the
+# same request.
+queued_request = contextvars.ContextVar("queued_request", default=None)
+
+
+@asynccontextmanager
+async def queue_slot():
+    """
+    Holds a slot in the fair queue for the current request, if it has to be
+    queued.
+    """
+    request = queued_request.get()
+    if request is None:
+        yield
+        return
+
+    queue, client, cost, weight = request
+    await queue.acquire(client, cost, weight)
+    try:
+        yield
+    finally:
+        queue.release()
+
+
+def forwarded_client(scope, trusted_proxies=0):
+    """
+    Identifies the client by its address. Behind `trusted_proxies` proxies
+    that each append to X-Forwarded-For, the client is the entry that many
+    places from the right; anything left of it could have been sent by the
+    client. With no trusted proxies the connection's address is used.
+    """
+    if trusted_proxies:
+        forwarded = []
+        for key, value in scope["headers"]:
+            if key == b"x-forwarded-for":
+                forwarded += value.decode("latin-1").split(",")
+        forwarded = [address.strip() for address in forwarded if address.strip()]
+        if len(forwarded) >= trusted_proxies:
+            return forwarded[-trusted_proxies]
+
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+class RateLimitMiddleware:
+    """
+    ASGI middleware that rate limits each client with a token bucket and
+    queues expensive routes fairly between clients.
+
+    * `route_costs`: list of `(path regex, cost, expensive)`. The first
+      pattern that fully matches the path is used; other paths cost 1 and
+      are not queued.
+    * `capacity`, `refill_rate`: size of each client's bucket and how many
+      tokens per second it gets back.
+    * `client_weights`: dict of client -> weight. A client's bucket and share
+      of the fair queue are scaled by its weight (default 1). A request never
+      costs more than its client's whole bucket, so small buckets can still
+      reach every route.
+    * `max_concurrent`: how many expensive computations run at once. The
+      routes enter the queue through `queue_slot`.
+    * `trusted_proxies`: how many proxies in front of the app append to
+      X-Forwarded-For. With 0, X-Forwarded-For is ignored.
+    * `max_clients`: how many buckets to keep. When full, the least recently
+      used bucket is dropped.
+
+    Responses get `X-RateLimit-Limit`, `X-RateLimit-Remaining` and
+    `X-RateLimit-Cost` headers, except responses with `Cache-Control: public`:
+    those are stored by shared caches and served to other clients, so they
+    must not carry one client's numbers. Routes whose limits clients need to
+    see should be cached as `private`. Requests over the limit get a 429 with
+    `Retry-After`.
+    """
+
+    def __init__(
+        self,
+        app,
+        route_costs=(),
+        capacity=100,
+        refill_rate=10,
+        client_weights=None,
+        max_concurrent=4,
+        trusted_proxies=0,
+        max_clients=10000,
+    ):
+        if capacity <= 0 or refill_rate <= 0:
+            raise ValueError("capacity and refill_rate must be positive")
+        if client_weights and min(client_weights.values()) <= 0:
+            raise ValueError("client weights must be positive")
+
+        self.app = app
+        self.route_costs = [
+            (re.compile(pattern), cost, expensive)
+            for pattern, cost, expensive in route_costs
+        ]
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.client_weights = client_weights or {}
+        self.queue = FairQueue(max_concurrent)
+        self.trusted_proxies = trusted_proxies
+        self.max_clients = max_clients
+        self.buckets = OrderedDict()
+
+    def route_cost(self, path):
+        for pattern, cost, expensive in self.route_costs:
+            if pattern.fullmatch(path):
+                return cost, expensive
+        return 1, False
+
+    def bucket(self, client, now):
+        bucket = self.buckets.get(client)
+        if bucket is None:
+            if len(self.buckets) >= self.max_clients:
+                self.buckets.popitem(last=False)
+            weight = self.client_weights.get(client, 1.0)
+            bucket = self.buckets[client] = TokenBucket(
+                self.capacity * weight, self.refill_rate * weight, now
+            )
+        else:
+            self.buckets.move_to_end(client)
+        return bucket
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        client = forwarded_client(scope, self.trusted_proxies)
+        cost, expensive = self.route_cost(scope["path"])
+        bucket = self.bucket(client, time.monotonic())
+        cost = min(cost, bucket.capacity)
+        allowed, retry_after = bucket.take(cost, time.monotonic())
+
+        headers = [
+            (b"x-ratelimit-limit", str(int(bucket.capacity)).encode("latin-1")),
+            (b"x-ratelimit-remaining", str(int(bucket.tokens)).encode("latin-1")),
+            (b"x-ratelimit-cost", str(int(cost)).encode("latin-1")),
+        ]
+
+        if not allowed:
+            body = json.dumps({"detail": "rate limit exceeded."}).encode("utf-8")
+            headers += [
+                (b"retry-after", str(math.ceil(retry_after)).encode("latin-1")),
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("latin-1")),
+            ]
+            await send(
+                {"type": "http.response.start", "status": 429, "headers": headers}
+            )
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                cache_control = b"".join(
+                    value for key, value in message["headers"]
+                    if key.lower() == b"cache-control"
+                )
+                if b"public" not in cache_control.lower():
+                    message = {
+                        **message, "headers": list(message["headers"]) + headers
+                    }
+            await send(message)
+
+        if not expensive:
+            await self.app(scope, receive, send_wrapper)
+            return
+
+        weight = self.client_weights.get(client, 1.0)
+        token = queued_request.set((self.queue, client, cost, weight))
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            queued_request.reset(token)
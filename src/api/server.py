@@ -1,5 +1,8 @@
 from fastapi import FastAPI
 from src.api import characters, movies, lines, pkg_util
+from src.api.http_cache import HTTPCacheMiddleware, PrecompressedPayload
+from src.api.rate_limit import RateLimitMiddleware
+import os
 
 description = """
 Movie API returns dialog statistics on top hollywood movies from decades past.
@@ -47,6 +50,78 @@ app.include_router(lines.router)
 app.include_router(pkg_util.router)
 
 
+# The data never changes while the server is running, so every data route can
+# be cached. The movie and character list/detail pages are public so the CDN
+# can serve them. The expensive routes below are rate limited per client and
+# carry that client's X-RateLimit-* headers, so they are private: browsers may
+# cache them, but shared caches must not hand them to other clients. Vary:
+# Accept-Encoding is always added by the middleware so compressed and plain
+# copies are kept apart.
+CACHE_MAX_AGE = int(os.environ.get("CACHE_MAX_AGE", 3600))
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 500))
+
+public_cache_control = f"public, max-age={CACHE_MAX_AGE}"
+private_cache_control = f"private, max-age={CACHE_MAX_AGE}"
+cache_rules = [
+    (r"/movies/(\d+)?", public_cache_control),
+    (r"/characters/", public_cache_control),
+    (r"/characters/\d+", private_cache_control),
+    (r"/lines/\d+/", private_cache_control),
+    (r"/conversations/\d+/", private_cache_control),
+    (r"/conversation/\d+", private_cache_control),
+]
+
+
+def precompress(endpoint, **params):
+    return PrecompressedPayload(endpoint(**params).body)
+
+
+# The default list pages are by far the most requested, so they are rendered
+# and compressed once here instead of on every request.
+precompressed = {
+    "/movies/": precompress(movies.list_movies, limit=50, offset=0),
+    "/characters/": precompress(characters.list_characters, limit=50, offset=0),
+}
+
+app.add_middleware(
+    HTTPCacheMiddleware,
+    cache_rules=cache_rules,
+    minimum_size=COMPRESS_MIN_SIZE,
+    precompressed=precompressed,
+)
+
+
+# Routes that scan lines or conversations cost more and share a fair queue.
+# Added last so it runs first and rejected requests never reach the routes.
+# X-Forwarded-For is only trusted when TRUSTED_PROXIES says how many proxies
+# sit in front of the app. Rate limit headers are left off the public pages
+# above so the CDN doesn't hand one client's limits to everyone; the
+# expensive routes, which are the ones a client can run out of budget on, are
+# private and always carry them.
+RATE_LIMIT_CAPACITY = int(os.environ.get("RATE_LIMIT_CAPACITY", 100))
+RATE_LIMIT_REFILL = float(os.environ.get("RATE_LIMIT_REFILL", 10))
+EXPENSIVE_MAX_CONCURRENT = int(os.environ.get("EXPENSIVE_MAX_CONCURRENT", 4))
+TRUSTED_PROXIES = int(os.environ.get("TRUSTED_PROXIES", 0))
+
+route_costs = [
+    (r"/lines/\d+/", 10, True),
+    (r"/conversations/\d+/", 10, True),
+    (r"/conversation/\d+", 5, True),
+    (r"/characters/\d+", 5, True),
+    (r"/movies/\d+", 2, False),
+    (r"/(movies|characters)/", 2, False),
+]
+
+app.add_middleware(
+    RateLimitMiddleware,
+    route_costs=route_costs,
+    capacity=RATE_LIMIT_CAPACITY,
+    refill_rate=RATE_LIMIT_REFILL,
+    max_concurrent=EXPENSIVE_MAX_CONCURRENT,
+    trusted_proxies=TRUSTED_PROXIES,
+)
+
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to the Movie API. See /docs for more information."}
@@ -0,0 +1,96 @@
+from contextlib import asynccontextmanager
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+from src.api.rate_limit import queue_slot
+import asyncio
+import os
+
+# When many identical requests arrive at once, only the first one does the work
+# and the rest wait for its result instead of repeating the same scan. The
+# routes call this from async dependencies, so waiting happens on the event
+# loop and only the scan itself runs in the thread pool.
+
+
+@asynccontextmanager
+async def no_gate():
+    yield
+
+
+class _Call:
+    def __init__(self):
+        # Set once the leader has got past its gate and is running `fn`
+        self.started = asyncio.Event()
+        self.result = asyncio.get_running_loop().create_future()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into a single call of `fn` in
+    the thread pool.
+
+    The result is shared between every caller, so it should not be mutated
+    or be a generator.
+
+    The leader holds `gate()` around `fn`, so only calls that really do the
+    work take a slot in the rate limiter's fair queue. Waiting callers start
+    their `timeout` only once the leader is running, so time the leader spends
+    queued doesn't count. A caller that times out gets a 504; it never starts
+    the same computation again.
+
+    `stats` counts:
+    * `calls`: every call to `do`.
+    * `executions`: calls that ran `fn` as the leader for their key.
+    * `coalesced`: calls that waited on another call's result.
+    * `timeouts`: waiting calls that gave up with a 504.
+    """
+
+    def __init__(self, timeout=10.0, gate=no_gate):
+        self.timeout = timeout
+        self.gate = gate
+        self._calls = {}
+        self.stats = {"calls": 0, "executions": 0, "coalesced": 0, "timeouts": 0}
+
+    async def do(self, key, fn, *args):
+        self.stats["calls"] += 1
+        call = self._calls.get(key)
+        if call is None:
+            return await self.lead(key, fn, *args)
+
+        self.stats["coalesced"] += 1
+        await call.started.wait()
+        try:
+            return await asyncio.wait_for(asyncio.shield(call.result), self.timeout)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            raise HTTPException(
+                status_code=504, detail="timed out waiting for a shared result."
+            )
+
+    async def lead(self, key, fn, *args):
+        call = self._calls[key] = _Call()
+        self.stats["executions"] += 1
+        try:
+            async with self.gate():
+                call.started.set()
+                result = await run_in_threadpool(fn, *args)
+        except Exception as e:
+            call.result.set_exception(e)
+            # Mark it retrieved, so it isn't logged when nobody was waiting
+            call.result.exception()
+            raise
+        except BaseException:
+            call.result.cancel()
+            raise
+        else:
+            call.result.set_result(result)
+            return result
+        finally:
+            call.started.set()
+            del self._calls[key]
+
+
+# Shared by all routers so the stats cover every coalesced route. Keys start
+# with the route name so they can't collide.
+flight = SingleFlight(
+    timeout=float(os.environ.get("SINGLEFLIGHT_TIMEOUT", 10)), gate=queue_slot
+)
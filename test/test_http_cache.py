@@ -0,0 +1,130 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src.api.http_cache import (
+    HTTPCacheMiddleware,
+    PrecompressedPayload,
+    choose_encoding,
+)
+
+import gzip
+import json
+
+big = [{"movie_id": i, "movie_title": "a movie title"} for i in range(100)]
+
+app = FastAPI()
+
+
+@app.get("/movies/")
+def list_movies():
+    return big
+
+
+@app.api_route("/characters/", methods=["GET", "HEAD"])
+def list_characters():
+    return big
+
+
+@app.get("/small")
+def small():
+    return {"ok": True}
+
+
+precompressed_body = json.dumps(big).encode("utf-8")
+
+app.add_middleware(
+    HTTPCacheMiddleware,
+    cache_rules=[(r"/(movies|characters)/(\d+)?", "public, max-age=60")],
+    minimum_size=500,
+    precompressed={
+        "/movies/": PrecompressedPayload(precompressed_body),
+        "/characters/": PrecompressedPayload(precompressed_body),
+    },
+)
+
+client = TestClient(app)
+
+
+def test_choose_encoding():
+    assert choose_encoding("gzip, deflate, br") == "br"
+    assert choose_encoding("gzip;q=1.0, br;q=0") == "gzip"
+    assert choose_encoding("identity") is None
+    assert choose_encoding("") is None
+    assert choose_encoding("br;q=0, *") == "gzip"
+    assert choose_encoding("gzip;q=0, *") == "br"
+    assert choose_encoding("gzip;q=0, br;q=0, *") is None
+    assert choose_encoding("gzip;q=1, br;q=0.1") == "gzip"
+    assert choose_encoding("*;q=0.5, br;q=0.2") == "gzip"
+
+
+def test_gzip_and_cache_headers():
+    response = client.get("/movies/?limit=50", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["cache-control"] == "public, max-age=60"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.json() == big
+
+
+def test_brotli():
+    response = client.get("/movies/?limit=50", headers={"Accept-Encoding": "br"})
+    assert response.headers["content-encoding"] == "br"
+    assert response.json() == big
+
+
+def test_below_threshold():
+    response = client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert "cache-control" not in response.headers
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.json() == {"ok": True}
+
+
+def test_precompressed():
+    with client.stream(
+        "GET", "/movies/", headers={"Accept-Encoding": "gzip"}
+    ) as response:
+        raw = b"".join(response.iter_raw())
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["cache-control"] == "public, max-age=60"
+    assert gzip.decompress(raw) == precompressed_body
+
+    response = client.get("/movies/", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+    assert response.content == precompressed_body
+
+
+def test_head_not_precompressed():
+    # HEAD is answered by the route, with the same headers as an uncompressed
+    # GET of the route
+    get = client.get("/characters/?limit=50", headers={"Accept-Encoding": "identity"})
+
+    for url in ["/characters/", "/characters/?limit=50"]:
+        response = client.head(url, headers={"Accept-Encoding": "gzip"})
+        assert response.status_code == 200
+        assert response.content == b""
+        assert "content-encoding" not in response.headers
+        assert response.headers["content-length"] == get.headers["content-length"]
+        assert response.headers["content-length"] != str(len(precompressed_body))
+        assert response.headers["cache-control"] == "public, max-age=60"
+        assert response.headers["vary"] == "Accept-Encoding"
+
+
+def test_server_precompressed_pages_match_routes():
+    from src.api import server
+
+    server_client = TestClient(server.app)
+    for path, payload in server.precompressed.items():
+        # A query string skips the precompressed payload
+        response = server_client.get(
+            path + "?offset=0", headers={"Accept-Encoding": "identity"}
+        )
+        assert response.status_code == 200
+        assert payload.bodies[None] == response.content
+        for encoding in ("gzip", "br"):
+            if encoding in payload.bodies:
+                response = server_client.get(
+                    path, headers={"Accept-Encoding": encoding}
+                )
+                assert response.headers["content-encoding"] == encoding
+                assert response.content == payload.bodies[None]
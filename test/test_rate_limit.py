@@ -0,0 +1,252 @@
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+
+from src import database as db
+from src.api import lines
+from src.api.rate_limit import FairQueue, RateLimitMiddleware, TokenBucket
+from src.api.server import app as server_app
+
+import asyncio
+import httpx
+import pytest
+import time
+
+app = FastAPI()
+
+
+@app.get("/lines/{movie_id}/")
+def get_lines(movie_id: int):
+    return [movie_id]
+
+
+@app.get("/movies/")
+def list_movies():
+    return JSONResponse([], headers={"Cache-Control": "public, max-age=60"})
+
+
+# One trusted proxy, so the client is the last X-Forwarded-For entry
+app.add_middleware(
+    RateLimitMiddleware,
+    route_costs=[(r"/lines/\d+/", 10, True)],
+    capacity=25,
+    refill_rate=0.01,
+    client_weights={"10.0.0.2": 2},
+    trusted_proxies=1,
+)
+
+client = TestClient(app)
+
+
+def test_token_bucket():
+    bucket = TokenBucket(10, 2, now=0)
+    assert bucket.take(8, now=0) == (True, 0.0)
+    assert bucket.take(8, now=0) == (False, 3.0)
+    assert bucket.take(8, now=3) == (True, 0.0)
+
+
+def test_rate_limit_headers():
+    headers = {"X-Forwarded-For": "10.0.0.1"}
+    response = client.get("/lines/1/", headers=headers)
+    assert response.status_code == 200
+    assert response.headers["x-ratelimit-limit"] == "25"
+    assert response.headers["x-ratelimit-remaining"] == "15"
+    assert response.headers["x-ratelimit-cost"] == "10"
+
+    assert client.get("/lines/1/", headers=headers).status_code == 200
+    response = client.get("/lines/1/", headers=headers)
+    assert response.status_code == 429
+    assert response.json() == {"detail": "rate limit exceeded."}
+    assert int(response.headers["retry-after"]) > 0
+
+    # other clients have their own bucket
+    response = client.get("/lines/1/", headers={"X-Forwarded-For": "10.0.0.3"})
+    assert response.status_code == 200
+
+
+def test_spoofed_forwarded_for():
+    # Only the entry added by the trusted proxy counts, so every request
+    # takes from the same bucket
+    remaining = []
+    for i in range(3):
+        response = client.get(
+            "/lines/1/", headers={"X-Forwarded-For": f"1.2.3.{i}, 10.0.0.4"}
+        )
+        remaining.append(response.headers["x-ratelimit-remaining"])
+    assert remaining == ["15", "5", "5"]
+    assert response.status_code == 429
+
+    # Without trusted proxies the header is ignored
+    untrusted = FastAPI()
+    untrusted.get("/lines/{movie_id}/")(get_lines)
+    untrusted.add_middleware(
+        RateLimitMiddleware,
+        route_costs=[(r"/lines/\d+/", 10, True)],
+        capacity=25,
+        refill_rate=0.01,
+    )
+    untrusted_client = TestClient(untrusted)
+    remaining = []
+    for i in range(3):
+        response = untrusted_client.get(
+            "/lines/1/", headers={"X-Forwarded-For": f"1.2.3.{i}"}
+        )
+        remaining.append(response.headers["x-ratelimit-remaining"])
+    assert remaining == ["15", "5", "5"]
+    assert response.status_code == 429
+
+
+def test_public_responses_have_no_client_headers():
+    response = client.get("/movies/", headers={"X-Forwarded-For": "10.0.0.5"})
+    assert response.status_code == 200
+    assert "x-ratelimit-remaining" not in response.headers
+    assert "x-ratelimit-limit" not in response.headers
+
+
+def test_max_clients():
+    middleware = RateLimitMiddleware(app=None, capacity=25, max_clients=2)
+    for i in range(5):
+        middleware.bucket(f"10.0.1.{i}", now=0).take(10, now=0)
+    assert list(middleware.buckets) == ["10.0.1.3", "10.0.1.4"]
+
+
+def test_max_clients_keeps_recently_used():
+    middleware = RateLimitMiddleware(app=None, capacity=25, max_clients=2)
+    middleware.bucket("10.0.1.0", now=0)
+    middleware.bucket("10.0.1.1", now=0)
+    middleware.bucket("10.0.1.0", now=0)
+    middleware.bucket("10.0.1.2", now=0)
+    assert list(middleware.buckets) == ["10.0.1.0", "10.0.1.2"]
+
+
+def test_cost_capped_at_bucket_capacity():
+    small = FastAPI()
+    small.get("/lines/{movie_id}/")(get_lines)
+    small.add_middleware(
+        RateLimitMiddleware,
+        route_costs=[(r"/lines/\d+/", 10, True)],
+        capacity=25,
+        refill_rate=1,
+        client_weights={"testclient": 0.2},
+    )
+    response = TestClient(small).get("/lines/1/")
+    assert response.status_code == 200
+    assert response.headers["x-ratelimit-limit"] == "5"
+    assert response.headers["x-ratelimit-cost"] == "5"
+
+
+def test_rejects_unusable_limits():
+    with pytest.raises(ValueError):
+        RateLimitMiddleware(app=None, capacity=0)
+    with pytest.raises(ValueError):
+        RateLimitMiddleware(app=None, client_weights={"10.0.0.1": 0})
+
+
+def test_client_weights():
+    response = client.get("/lines/1/", headers={"X-Forwarded-For": "10.0.0.2"})
+    assert response.headers["x-ratelimit-limit"] == "50"
+
+
+def test_fair_queue():
+    order = []
+
+    async def request(queue, client):
+        await queue.acquire(client, cost=10)
+        order.append(client)
+        await asyncio.sleep(0)
+        queue.release()
+
+    async def run():
+        queue = FairQueue(max_concurrent=1)
+        await queue.acquire("other")
+        # a heavy client queues up first, then a light one arrives
+        tasks = [asyncio.create_task(request(queue, "crawler")) for _ in range(5)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(request(queue, "light")))
+        await asyncio.sleep(0)
+        queue.release()
+        await asyncio.gather(*tasks)
+        assert queue.active == 0
+
+    asyncio.run(run())
+    assert order.index("light") == 1
+
+
+async def server_get(i, url):
+    transport = httpx.ASGITransport(
+        app=server_app, client=(f"10.1.{i // 250}.{i % 250}", 123)
+    )
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://test"
+    ) as async_client:
+        return await async_client.get(url)
+
+
+def test_cheap_route_fast_while_queue_full(monkeypatch):
+    # More queued expensive requests than the thread pool has threads. They
+    # wait on the event loop, so a cheap route still gets a thread right away.
+    find_lines = lines.find_lines
+
+    def slow_find_lines(movie_id, character):
+        time.sleep(0.2)
+        return find_lines(movie_id, character)
+
+    monkeypatch.setattr(lines, "find_lines", slow_find_lines)
+    movie_ids = list(db.movies)[:48]
+
+    async def run():
+        busy = [
+            asyncio.create_task(server_get(i, f"/lines/{movie_id}/"))
+            for i, movie_id in enumerate(movie_ids)
+        ]
+        await asyncio.sleep(0.05)
+        start = time.monotonic()
+        response = await server_get(200, "/movies/44")
+        elapsed = time.monotonic() - start
+        busy = await asyncio.gather(*busy)
+        return response, elapsed, busy
+
+    response, elapsed, busy = asyncio.run(run())
+
+    assert response.status_code == 200
+    assert elapsed < 0.15
+    assert all(r.status_code == 200 for r in busy)
+
+
+def test_queue_keeps_requests_coalesced(monkeypatch):
+    # More identical requests than queue slots still share one scan
+    calls = []
+    find_conversations = lines.find_conversations
+
+    def slow_find_conversations(movie_id, character):
+        calls.append(movie_id)
+        time.sleep(0.3)
+        return find_conversations(movie_id, character)
+
+    monkeypatch.setattr(lines, "find_conversations", slow_find_conversations)
+
+    async def run():
+        return await asyncio.gather(*(
+            server_get(i, "/conversations/0/") for i in range(20)
+        ))
+
+    responses = asyncio.run(run())
+
+    assert calls == [0]
+    assert all(r.status_code == 200 for r in responses)
+    assert all(r.content == responses[0].content for r in responses)
+
+
+def test_expensive_routes_private_with_headers():
+    async def run():
+        return await asyncio.gather(
+            server_get(201, "/lines/0/"), server_get(201, "/movies/44")
+        )
+
+    expensive, cheap = asyncio.run(run())
+
+    assert expensive.headers["cache-control"].startswith("private")
+    assert expensive.headers["x-ratelimit-cost"] == "10"
+    assert "x-ratelimit-remaining" in expensive.headers
+    assert cheap.headers["cache-control"].startswith("public")
+    assert "x-ratelimit-remaining" not in cheap.headers
@@ -0,0 +1,210 @@
+from fastapi import HTTPException
+from src import database as db
+from src.api import characters, lines
+from src.api.server import app
+from src.api.singleflight import SingleFlight, flight
+
+from contextlib import asynccontextmanager
+import asyncio
+import httpx
+import time
+
+import pytest
+
+
+def sleep_then(seconds, result, runs):
+    def fn():
+        runs.append(result)
+        time.sleep(seconds)
+        return result
+    return fn
+
+
+def test_concurrent_calls_run_once():
+    flight = SingleFlight()
+    runs = []
+
+    async def run():
+        return await asyncio.gather(*(
+            flight.do(("conversations", 1, ""), sleep_then(0.2, [1], runs))
+            for _ in range(21)
+        ))
+
+    assert asyncio.run(run()) == [[1]] * 21
+    assert runs == [[1]]
+    assert flight.stats == {
+        "calls": 21, "executions": 1, "coalesced": 20, "timeouts": 0
+    }
+
+
+def test_different_keys_not_coalesced():
+    flight = SingleFlight()
+
+    async def run():
+        assert await flight.do(("lines", 1, ""), lambda: 1) == 1
+        assert await flight.do(("lines", 2, ""), lambda: 2) == 2
+
+    asyncio.run(run())
+    assert flight.stats["executions"] == 2
+
+
+def test_error_shared():
+    flight = SingleFlight()
+
+    def failing():
+        time.sleep(0.1)
+        raise ValueError("boom")
+
+    async def run():
+        return await asyncio.gather(
+            flight.do("key", failing), flight.do("key", failing),
+            return_exceptions=True,
+        )
+
+    errors = asyncio.run(run())
+    assert [type(e) for e in errors] == [ValueError, ValueError]
+    assert flight.stats["executions"] == 1
+
+    with pytest.raises(ValueError):
+        asyncio.run(flight.do("key", failing))
+
+
+def test_timeout_starts_after_gate():
+    # The leader waits 0.3s for its gate, longer than the timeout, but waiters
+    # only start counting once it is running
+    @asynccontextmanager
+    async def slow_gate():
+        await asyncio.sleep(0.3)
+        yield
+
+    flight = SingleFlight(timeout=0.2, gate=slow_gate)
+    runs = []
+
+    async def run():
+        return await asyncio.gather(*(
+            flight.do("key", sleep_then(0.05, "result", runs)) for _ in range(5)
+        ))
+
+    assert asyncio.run(run()) == ["result"] * 5
+    assert runs == ["result"]
+    assert flight.stats["timeouts"] == 0
+
+
+def test_timeout_gives_504():
+    flight = SingleFlight(timeout=0.05)
+    runs = []
+
+    async def run():
+        return await asyncio.gather(
+            flight.do("key", sleep_then(0.3, "slow", runs)),
+            flight.do("key", sleep_then(0.3, "again", runs)),
+            return_exceptions=True,
+        )
+
+    slow, waiter = asyncio.run(run())
+    assert slow == "slow"
+    assert isinstance(waiter, HTTPException) and waiter.status_code == 504
+    # the waiter never starts its own computation
+    assert runs == ["slow"]
+    assert flight.stats["timeouts"] == 1
+
+
+def slow(calls, fn, seconds=0.3):
+    def wrapper(*args):
+        calls.append(args)
+        time.sleep(seconds)
+        return fn(*args)
+    return wrapper
+
+
+async def get(i, url):
+    # Each request comes from its own address so none are rate limited
+    transport = httpx.ASGITransport(app=app, client=(f"10.2.{i // 250}.{i % 250}", 1))
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return await client.get(url)
+
+
+def get_concurrently(urls):
+    async def run():
+        return await asyncio.gather(*(get(i, url) for i, url in enumerate(urls)))
+
+    return asyncio.run(run())
+
+
+def test_conversations_coalesced(monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        lines, "find_conversations", slow(calls, lines.find_conversations)
+    )
+
+    responses = get_concurrently(["/conversations/0/"] * 10)
+
+    assert calls == [(0, "")]
+    assert all(r.status_code == 200 for r in responses)
+    assert all(r.content == responses[0].content for r in responses)
+
+
+def test_lines_coalesced_across_pages(monkeypatch):
+    # The character filter is normalized and paging happens after the scan
+    calls = []
+    monkeypatch.setattr(lines, "find_lines", slow(calls, lines.find_lines))
+
+    responses = get_concurrently([
+        "/lines/0/?character=bianca",
+        "/lines/0/?character=BIANCA&limit=5",
+        "/lines/0/?character=Bianca&offset=2",
+    ] * 3)
+
+    assert calls == [(0, "BIANCA")]
+    assert all(r.status_code == 200 for r in responses)
+    assert responses[0].content == responses[3].content
+
+
+def test_characters_coalesced(monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        characters,
+        "get_top_conv_characters",
+        slow(calls, characters.get_top_conv_characters),
+    )
+
+    responses = get_concurrently(["/characters/2"] * 10)
+
+    assert len(calls) == 1
+    assert all(r.status_code == 200 for r in responses)
+    assert all(r.content == responses[0].content for r in responses)
+
+
+def test_coalesced_while_queue_is_full(monkeypatch):
+    # Slow /lines requests hold every fair queue slot. Identical /conversations
+    # requests then queue once and share the scan instead of timing out.
+    monkeypatch.setattr(flight, "timeout", 0.5)
+    line_calls, conv_calls = [], []
+    monkeypatch.setattr(
+        lines, "find_lines", slow(line_calls, lines.find_lines, seconds=0.8)
+    )
+    monkeypatch.setattr(
+        lines, "find_conversations", slow(conv_calls, lines.find_conversations)
+    )
+    movie_ids = list(db.movies)[:4]
+    timeouts = flight.stats["timeouts"]
+
+    async def run():
+        busy = [
+            asyncio.create_task(get(i, f"/lines/{movie_id}/"))
+            for i, movie_id in enumerate(movie_ids)
+        ]
+        await asyncio.sleep(0.05)
+        responses = await asyncio.gather(*(
+            get(100 + i, "/conversations/0/") for i in range(10)
+        ))
+        await asyncio.gather(*busy)
+        return responses
+
+    responses = asyncio.run(run())
+
+    assert len(line_calls) == 4
+    assert conv_calls == [(0, "")]
+    assert flight.stats["timeouts"] == timeouts
+    assert all(r.status_code == 200 for r in responses)
+    assert all(r.content == responses[0].content for r in responses)